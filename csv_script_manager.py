@@ -379,7 +379,8 @@ class CSVEditorHandler(SimpleHTTPRequestHandler):
             scripts = []
             if os.path.exists(self.scripts_dir):
                 for filename in os.listdir(self.scripts_dir):
-                    if filename.endswith('.py'):
+                    # Underscore-prefixed modules are shared helpers imported by scripts, not scripts
+                    if filename.endswith('.py') and not filename.startswith('_'):
                         filepath = os.path.join(self.scripts_dir, filename)
                         if os.path.isfile(filepath):
                             description = self.extract_docstring(filepath)
@@ -451,8 +452,10 @@ class CSVEditorHandler(SimpleHTTPRequestHandler):
                 # The wrapper preserves sys.argv so scripts can access command-line arguments
                 wrapper_script = f'''import sys
 import os
-# Add app directory to Python path so scripts can import from parent folder
+# Add app directory to Python path so scripts can import from parent folder,
+# and the scripts directory so scripts can import shared helper modules (e.g. _csv_config)
 sys.path.insert(0, r'{script_dir}')
+sys.path.insert(0, r'{self.scripts_dir}')
 # Execute the actual script with proper sys.argv
 sys.argv = [r'{script_path}', r'{csv_filepath}']
 exec(compile(open(r'{script_path}').read(), r'{script_path}', 'exec'))
@@ -35,13 +35,19 @@ Requirements:
     - NCM / NCX API access
     - API keys and token via environment (or API Keys tab): X_ECM_API_ID, X_ECM_API_KEY,
       X_CP_API_ID, X_CP_API_KEY, TOKEN or NCM_API_TOKEN
+    - Optional: `orjson` for faster parsing of NCM API responses
 """
 
-import csv
+import functools
 import ipaddress
-import os
 import sys
+from collections.abc import Iterable
+from concurrent.futures import Future
 
+from _csv_config import ConfigError, load_config
+from _ncm_routers import get_sites_by_name, iter_row_routers, site_router_id
+from _ncm_session import build_api_keys, configure_session
+from _report_pool import ReportingPool
 from ncm import ncm
 
 
@@ -50,130 +56,17 @@ def classify_resource_target(value: str) -> tuple[str, dict[str, str]]:
     Classify a target string as an IP/subnet or (wildcard) FQDN and
     return (resource_type, extra_kwargs) for create_exchange_resource().
     """
-    # First, try to interpret as IPv4 address or subnet
-    try:
-        ipaddress.ip_network(value, strict=False)
-        return "exchange_ipsubnet_resources", {"ip": value}
-    except ValueError:
-        # Not an IP/subnet; treat as domain
-        if value.startswith("*."):
-            return "exchange_wildcard_fqdn_resources", {"domain": value}
-        return "exchange_fqdn_resources", {"domain": value}
-
-
-def load_config_from_csv(
-    csv_filename: str,
-) -> tuple[str, list[tuple[str, str, str | None, str, str | None]]]:
-    """
-    Read CSV and determine mode (router_id, group_id, or group_name) and rows.
-    Returns (mode, [(identifier, ncx_network_id, site_name_or_none, resource_value, resource_name_or_none), ...]).
-    """
-    try:
-        with open(csv_filename, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            if not reader.fieldnames:
-                raise ValueError("CSV file has no header row")
-
-            headers = {h.lower().strip(): h for h in reader.fieldnames}
-
-            network_key = next(
-                (headers[k] for k in ["ncx_network_id", "ncx network id"] if k in headers),
-                None,
-            )
-            if not network_key:
-                raise ValueError(
-                    "CSV must contain 'ncx_network_id'. "
-                    f"(found: {reader.fieldnames})"
-                )
-
-            resource_key = next(
-                (headers[k] for k in ["resource", "target"] if k in headers),
-                None,
-            )
-            if not resource_key:
-                raise ValueError(
-                    "CSV must contain 'resource' or 'target' (the value to create: IP, subnet, or domain). "
-                    f"(found: {reader.fieldnames})"
-                )
-
-            site_name_key = next(
-                (headers[k] for k in ["site_name", "site name"] if k in headers),
-                None,
-            )
-            resource_name_key = next(
-                (headers[k] for k in ["resource_name", "resource name"] if k in headers),
-                None,
-            )
-
-            router_key = next(
-                (headers[k] for k in ["id", "router_id", "router id"] if k in headers), None
-            )
-            group_id_key = next(
-                (headers[k] for k in ["group_id", "group id"] if k in headers), None
-            )
-            group_name_key = next(
-                (headers[k] for k in ["group_name", "group name"] if k in headers), None
-            )
-
-            if router_key:
-                mode = "router_id"
-            elif group_id_key and group_name_key:
-                raise ValueError(
-                    "CSV must not contain both 'group_id' and 'group_name'; use one or the other. "
-                    f"(found: {reader.fieldnames})"
-                )
-            elif group_id_key:
-                mode = "group_id"
-            elif group_name_key:
-                mode = "group_name"
-            else:
-                raise ValueError(
-                    "CSV must contain a router/device column ('id' or 'router_id') or a group "
-                    "column ('group_id' or 'group_name'). " f"(found: {reader.fieldnames})"
-                )
-            rows = []
-
-            for row in reader:
-                network_id = row.get(network_key, "").strip()
-                resource_value = row.get(resource_key, "").strip()
-                if not network_id or not resource_value:
-                    continue
-                site_name = row.get(site_name_key or "", "").strip() or None
-                resource_name = row.get(resource_name_key or "", "").strip() or None
-                if mode == "router_id":
-                    ident = row.get(router_key, "").strip()
-                    if ident:
-                        rows.append((ident, network_id, site_name, resource_value, resource_name))
-                elif mode == "group_id":
-                    ident = row.get(group_id_key, "").strip()
-                    if ident:
-                        rows.append((ident, network_id, site_name, resource_value, resource_name))
-                        break
-                else:
-                    ident = row.get(group_name_key, "").strip()
-                    if ident:
-                        rows.append((ident, network_id, site_name, resource_value, resource_name))
-                        break
-
-            if not rows:
-                raise ValueError(
-                    f"No data row with {mode}, ncx_network_id, and resource found"
-                )
-            return mode, rows
-    except FileNotFoundError:
-        raise FileNotFoundError(f"CSV file not found: {csv_filename}") from None
-
-
-def build_api_keys() -> dict:
-    """Build API keys dict, preferring environment variables."""
-    api_keys = {
-        "X-ECM-API-ID": os.environ.get("X_ECM_API_ID", ""),
-        "X-ECM-API-KEY": os.environ.get("X_ECM_API_KEY", ""),
-        "X-CP-API-ID": os.environ.get("X_CP_API_ID", ""),
-        "X-CP-API-KEY": os.environ.get("X_CP_API_KEY", ""),
-        "token": os.environ.get("TOKEN") or os.environ.get("NCM_API_TOKEN", ""),
-    }
-    return api_keys
+    if value.startswith("*."):
+        return "exchange_wildcard_fqdn_resources", {"domain": value}
+    # Only values that could be an address (leading digit, or any ':' for IPv6) go through
+    # the ipaddress parser; everything else is a domain and skips the raise-and-catch
+    if value[:1].isdigit() or ":" in value:
+        try:
+            ipaddress.ip_network(value, strict=False)
+            return "exchange_ipsubnet_resources", {"ip": value}
+        except ValueError:
+            pass  # e.g. "1password.com"
+    return "exchange_fqdn_resources", {"domain": value}
 
 
 def get_site(
@@ -185,7 +78,7 @@ def get_site(
     The chosen site must be associated with this router (validated via relationships).
     """
     name_to_use = (site_name_override or router["name"]).strip()
-    sites = n3.get_exchange_sites(name=name_to_use)
+    sites = get_sites_by_name(n3, name_to_use)
     if not sites:
         print(
             f'Site not found for router {router["id"]} {router["name"]}'
@@ -205,20 +98,15 @@ def get_site(
         )
         return None
 
-    site_router_id = ""
-    try:
-        site_router_id = first["relationships"]["endpoints"]["data"][0]["id"]
-        if str(site_router_id) != str(router["id"]):
-            raise ValueError
-    except (KeyError, IndexError, ValueError, TypeError) as e:
-        rel = first.get("relationships", {})
+    endpoint_id = site_router_id(first)
+    if endpoint_id != router["_sid"]:
+        rel = first.get("relationships")
         detail = repr(rel) if rel else "(no relationships)"
         if len(detail) > 250:
             detail = detail[:247] + "..."
         print(
             f"Site exists but wrong router or unexpected structure: "
-            f"{site_router_id or '?'} != {router['id']}\n  "
-            f"Error: {type(e).__name__}: {e}\n  "
+            f"{endpoint_id or '?'} != {router['id']}\n  "
             f"Site relationships: {detail}"
         )
         return None
@@ -226,80 +114,89 @@ def get_site(
     return first
 
 
+def report_resource(
+    router: dict, site: dict, resource_value: str, resource_type: str, future: Future
+) -> None:
+    """ReportingPool callback: print the outcome of a completed create_exchange_resource call."""
+    try:
+        resource = future.result()
+    except Exception as e:
+        print(
+            f"Error creating NCX resource {resource_value!r} for router {router['name']}: "
+            f"{type(e).__name__}: {e}"
+        )
+        return
+    if isinstance(resource, str):
+        if "overlapping_resource" not in resource:
+            print(resource)
+        return
+    if isinstance(resource, dict) and (resource.get("data") or resource.get("id")):
+        # API returns JSON:API style: site has attributes.name, not top-level name
+        site_name = (site.get("attributes") or {}).get("name") or site.get("name") or site.get("id") or "site"
+        print(
+            f"Created NCX resource {resource_value!r} for router "
+            f'{router["name"]}, site {site_name}. (type={resource_type})'
+        )
+    else:
+        print(
+            f"Error creating NCX resource {resource_value!r} for router {router['name']}. "
+            "Check subscriptions (router/site may need NCX license)."
+        )
+        if resource is not None:
+            print(f"  API response: {resource}")
+
+
 def create_ncx_resources(
     mode: str,
-    rows: list[tuple[str, str, str | None, str, str | None]],
+    rows: Iterable[tuple[str, str, str, str | None, str | None]],
 ) -> None:
     """Create NCX resources from CSV rows: one resource per row, type detected from value (IP/subnet or FQDN)."""
     api_keys = build_api_keys()
-    token = api_keys.get("token") or os.environ.get("TOKEN") or os.environ.get("NCM_API_TOKEN")
+    token = api_keys.token
     if not token:
         print("Error: TOKEN or NCM_API_TOKEN is required for NCX v3 API (set in API Keys tab).")
         return
 
-    n2 = ncm.NcmClientv2(api_keys=api_keys, log_events=False)
+    n2 = ncm.NcmClientv2(api_keys=api_keys.v2_headers(), log_events=False)
     n3 = ncm.NcmClientv3(api_key=token, log_events=False)
-
-    for identifier, ncx_network_id, site_name_override, resource_value, resource_name_override in rows:
-        if mode == "router_id":
-            routers = n2.get_routers(id__in=[identifier])
-        else:
-            routers = n2.get_routers(group=identifier, limit="all")
-
-        if not routers:
-            print(f"No routers found for {mode}={identifier!r}.")
-            continue
-
-        name = (resource_name_override or resource_value).strip()
-        if len(name) < 3:
-            print(
-                f"Skipping resource {resource_value!r}: name must be at least 3 characters (use resource_name or a longer value)."
-            )
-            continue
-
-        resource_type, extra_kwargs = classify_resource_target(resource_value.strip())
-
-        for router in routers:
-            print(
-                f'Creating NCX resource {resource_value!r} for router {router["id"]} {router["name"]} '
-                f"in network {ncx_network_id}..."
-            )
-            site = get_site(n3, router, site_name_override=site_name_override)
-            if not site:
+    configure_session(n2)
+    configure_session(n3)
+
+    # Routers and sites are resolved serially; resource creation fans out to the pool
+    with ReportingPool() as pool:
+        for row, routers in iter_row_routers(n2, mode, rows):
+            identifier, ncx_network_id, resource_value, site_name_override, resource_name_override = row
+            if not routers:
+                print(f"No routers found for {mode}={identifier!r}.")
                 continue
 
-            try:
-                resource = n3.create_exchange_resource(
-                    site_id=site["id"],
-                    resource_name=name,
-                    resource_type=resource_type,
-                    **extra_kwargs,
-                )
-            except Exception as e:
+            name = (resource_name_override or resource_value).strip()
+            if len(name) < 3:
                 print(
-                    f"Error creating NCX resource {resource_value!r} for router {router['name']}: "
-                    f"{type(e).__name__}: {e}"
+                    f"Skipping resource {resource_value!r}: name must be at least 3 characters (use resource_name or a longer value)."
                 )
                 continue
-            if isinstance(resource, str):
-                if "overlapping_resource" not in resource:
-                    print(resource)
-                continue
-            if isinstance(resource, dict) and (resource.get("data") or resource.get("id")):
-                # API returns JSON:API style: site has attributes.name, not top-level name
-                site_name = (site.get("attributes") or {}).get("name") or site.get("name") or site.get("id") or "site"
+
+            resource_type, extra_kwargs = classify_resource_target(resource_value.strip())
+
+            for router in routers:
                 print(
-                    f"Created NCX resource {resource_value!r} for router "
-                    f'{router["name"]}, site {site_name}. (type={resource_type})'
+                    f'Creating NCX resource {resource_value!r} for router {router["id"]} {router["name"]} '
+                    f"in network {ncx_network_id}..."
                 )
-            else:
-                print(
-                    f"Error creating NCX resource {resource_value!r} for router {router['name']}. "
-                    "Check subscriptions (router/site may need NCX license)."
+                site = get_site(n3, router, site_name_override=site_name_override)
+                if not site:
+                    continue
+
+                pool.submit(
+                    functools.partial(report_resource, router, site, resource_value, resource_type),
+                    n3.create_exchange_resource,
+                    site_id=site["id"],
+                    resource_name=name,
+                    resource_type=resource_type,
+                    **extra_kwargs,
                 )
-                if resource is not None:
-                    print(f"  API response: {resource}")
-        print()
+    print()
 
 
 def main() -> None:
@@ -310,12 +207,21 @@ def main() -> None:
     csv_filename = sys.argv[1]
 
     try:
-        mode, rows = load_config_from_csv(csv_filename)
+        mode, rows = load_config(
+            csv_filename,
+            required=("ncx_network_id", "resource"),
+            optional=("site_name", "resource_name"),
+            hints={"resource": "the value to create: IP, subnet, or domain"},
+        )
     except Exception as exc:
         print(f"Error reading configuration from CSV: {exc}")
         sys.exit(1)
 
-    create_ncx_resources(mode, rows)
+    try:
+        create_ncx_resources(mode, rows)
+    except ConfigError as exc:
+        print(f"Error reading configuration from CSV: {exc}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -30,207 +30,324 @@ CSV Format (case-insensitive). Device/group columns (priority order):
         My Group,abcd-efgh-ijkl
 
 Usage:
-    python "Create NCX Sites.py" <config_csv_path>
+    python "Create NCX Sites.py" <config_csv_path> [--verify | --no-verify]
+
+    Each created site's endpoint is checked against the router. By default this uses the create response,
+    falling back to one site listing per network when the response lacks the endpoint:
+        --verify     always check against the network site listing
+        --no-verify  never fetch the listing; such sites are reported as created but unverified
 
 Requirements:
     - NCM Python helper module `ncm` available in PYTHONPATH
     - NCM / NCX API access
     - API keys and token via environment (or API Keys tab): X_ECM_API_ID, X_ECM_API_KEY,
       X_CP_API_ID, X_CP_API_KEY, TOKEN or NCM_API_TOKEN
+    - Optional: `orjson` for faster parsing of NCM API responses
 """
 
-import csv
-import os
+import argparse
+import functools
 import sys
-
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future
+
+from _csv_config import ConfigError, load_config
+from _ncm_routers import iter_row_routers, site_router_id
+from _ncm_session import build_api_keys, configure_session
+from _report_pool import ReportingPool
 from ncm import ncm
 
+# Client-side cap on NCX v3 calls from the worker pool, kept a little under the API rate limit so
+# bursts of concurrent creates are paced instead of bouncing off 429s and retry backoff
+V3_MAX_REQUESTS_PER_MINUTE = 240
+
+
+class RateLimiter:
+    """Thread-safe sliding-window limiter: at most max_rate entries per period seconds; callers block until allowed."""
+
+    def __init__(self, max_rate: int, period: float) -> None:
+        self.max_rate = max_rate
+        self.period = period
+        self._calls: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "RateLimiter":
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_rate:
+                    self._calls.append(now)
+                    return self
+                wait = self.period - (now - self._calls[0])
+            time.sleep(wait)
 
-def load_config_from_csv(csv_filename: str) -> tuple[str, list[tuple[str, str, str | None]]]:
+    def __exit__(self, *exc_info) -> None:
+        return None
+
+
+class OutputBuffer:
     """
-    Read CSV and determine mode (router_id, group_id, or group_name) and rows.
-    Returns (mode, [(identifier, ncx_network_id, site_name_override), ...]).
-    site_name_override is from optional "site_name" column (router_id mode only), else None.
-    For group modes there is one entry; for router_id there can be many.
+    Collects status lines and writes them to stdout together: one write and flush per batch instead of a
+    print (and, on a terminal, a flush) per line. Pending lines are written when a line is added and either
+    batch_size lines are pending or interval seconds have passed since the last write, and on flush().
     """
+
+    def __init__(self, batch_size: int = 64, interval: float = 1.0) -> None:
+        self.batch_size = batch_size
+        self.interval = interval
+        self._lines: list[str] = []
+        self._last_write = time.monotonic()
+
+    def __call__(self, line: str) -> None:
+        self._lines.append(line)
+        if len(self._lines) >= self.batch_size or time.monotonic() - self._last_write >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._lines:
+            sys.stdout.write("\n".join(self._lines) + "\n")
+            sys.stdout.flush()
+            self._lines.clear()
+        self._last_write = time.monotonic()
+
+
+# Status output for create_ncx_sites; only written from the main thread
+emit = OutputBuffer()
+
+
+# classify_site_response() results
+SITE_CREATED_ID = 0  # create returned a string (e.g. the new site id)
+SITE_CREATED = 1  # create returned the created resource
+SITE_FAILED = 2  # anything else, e.g. an error payload or None
+
+
+def classify_site_response(site) -> int:
+    """Classify a create_exchange_site() response as SITE_CREATED_ID, SITE_CREATED or SITE_FAILED."""
+    kind = type(site)
+    if kind is str:
+        return SITE_CREATED_ID
+    if kind is dict and (site.get("data") or site.get("id")):
+        return SITE_CREATED
+    return SITE_FAILED
+
+
+def create_site(
+    create_exchange_site: Callable, limiter: RateLimiter, router: dict, site_name: str, ncx_network_id: str
+):
+    """Create the router's NCX site with the bound n3.create_exchange_site; runs on a worker thread."""
+    with limiter:
+        return create_exchange_site(site_name, ncx_network_id, router["id"])
+
+
+def report_create(future: Future, router: dict) -> bool:
+    """Print a failed create_site call. Returns True if the site was created (and should be verified)."""
     try:
-        with open(csv_filename, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            if not reader.fieldnames:
-                raise ValueError("CSV file has no header row")
-
-            headers = {h.lower().strip(): h for h in reader.fieldnames}
-
-            network_key = next(
-                (headers[k] for k in ["ncx_network_id", "ncx network id"] if k in headers),
-                None,
-            )
-            if not network_key:
-                raise ValueError(
-                    "CSV must contain 'ncx_network_id'. "
-                    f"(found: {reader.fieldnames})"
-                )
-
-            router_key = next(
-                (headers[k] for k in ["id", "router_id", "router id"] if k in headers), None
-            )
-            group_id_key = next(
-                (headers[k] for k in ["group_id", "group id"] if k in headers), None
-            )
-            group_name_key = next(
-                (headers[k] for k in ["group_name", "group name"] if k in headers), None
-            )
-            site_name_key = next(
-                (headers[k] for k in ["site_name", "site name"] if k in headers), None
-            )
-
-            if router_key:
-                mode = "router_id"
-            elif group_id_key and group_name_key:
-                raise ValueError(
-                    "CSV must not contain both 'group_id' and 'group_name'; use one or the other. "
-                    f"(found: {reader.fieldnames})"
-                )
-            elif group_id_key:
-                mode = "group_id"
-            elif group_name_key:
-                mode = "group_name"
-            else:
-                raise ValueError(
-                    "CSV must contain a router/device column ('id' or 'router_id') or a group "
-                    "column ('group_id' or 'group_name'). " f"(found: {reader.fieldnames})"
-                )
-            rows = []
-
-            for row in reader:
-                network_id = row.get(network_key, "").strip()
-                if not network_id:
-                    continue
-                site_override = None
-                if site_name_key:
-                    site_override = row.get(site_name_key, "").strip() or None
-                if mode == "router_id":
-                    ident = row.get(router_key, "").strip()
-                    if ident:
-                        rows.append((ident, network_id, site_override))
-                elif mode == "group_id":
-                    ident = row.get(group_id_key, "").strip()
-                    if ident:
-                        rows.append((ident, network_id, None))
-                        break
-                else:
-                    ident = row.get(group_name_key, "").strip()
-                    if ident:
-                        rows.append((ident, network_id, None))
-                        break
-
-            if not rows:
-                raise ValueError(
-                    f"No data row with {mode} and ncx_network_id found"
-                )
-            return mode, rows
-    except FileNotFoundError:
-        raise FileNotFoundError(f"CSV file not found: {csv_filename}") from None
-
-
-def build_api_keys() -> dict:
-    """Build API keys dict, preferring environment variables."""
-    api_keys = {
-        "X-ECM-API-ID": os.environ.get("X_ECM_API_ID", ""),
-        "X-ECM-API-KEY": os.environ.get("X_ECM_API_KEY", ""),
-        "X-CP-API-ID": os.environ.get("X_CP_API_ID", ""),
-        "X-CP-API-KEY": os.environ.get("X_CP_API_KEY", ""),
-        "token": os.environ.get("TOKEN") or os.environ.get("NCM_API_TOKEN", ""),
-    }
-    return api_keys
-
-
-def create_ncx_sites(mode: str, rows: list[tuple[str, str, str | None]]) -> None:
-    """Create NCX sites for routers specified by mode and (identifier, ncx_network_id, site_name_override) rows."""
+        site = future.result()
+    except Exception as e:
+        emit(
+            f'Error creating NCX site for router {router["id"]} {router["name"]}: '
+            f"{type(e).__name__}: {e}"
+        )
+        return False
+    if classify_site_response(site) != SITE_FAILED:
+        return True
+    # Real failure: show what the API returned (e.g. license/validation errors)
+    emit(
+        f'Error creating NCX site for router {router["id"]} {router["name"]}.  '
+        "Check subscriptions (router may need NCX-capable subscription / network license)."
+    )
+    if site is not None:
+        emit(f"  API response: {site}")
+    return False
+
+
+def created_site_resource(site) -> dict | None:
+    """
+    The site resource from a successful create_exchange_site() response if it already carries its endpoints
+    (ncm returns the created resource on 201), else None and the site is verified from the network listing.
+    """
+    if classify_site_response(site) != SITE_CREATED:
+        return None
+    resource = site["data"] if type(site.get("data")) is dict else site
+    endpoints = (resource.get("relationships") or {}).get("endpoints")
+    # An empty endpoints list (e.g. {"data": []}) says nothing about the router: verify from the listing
+    return resource if type(endpoints) is dict and endpoints.get("data") else None
+
+
+def fetch_network_sites(
+    n3: ncm.NcmClientv3, limiter: RateLimiter, ncx_network_id: str
+) -> dict[str, object] | None:
+    """
+    All sites in the network keyed by name: one paginated listing instead of a lookup per created site.
+    Returns None when the listing holds no site data (an error payload, or ncm's "No sites found" string when
+    throttled or the new sites are not visible yet). Runs on a worker thread.
+    """
+    with limiter:
+        sites = n3.get_exchange_sites(exchange_network_id=ncx_network_id, limit=0)
+    if not isinstance(sites, list):
+        return None
+    by_name: dict[str, object] = {}
+    for site in sites:
+        if isinstance(site, dict):
+            by_name[(site.get("attributes") or {}).get("name") or site.get("name")] = site
+    return by_name or None
+
+
+def report_unverified(router: dict, reason: str) -> None:
+    """Print that the router's site was created but its endpoint could not be checked."""
+    emit(f'Created exchange site for router {router["id"]} {router["name"]} (could not verify endpoint: {reason})')
+
+
+def report_verified(router: dict, site) -> None:
+    """Print whether the created site (from the create response or the network listing) is attached to the router."""
+    if site is None:
+        report_unverified(router, "site not in the network site listing")
+        return
+
+    endpoint_id = site_router_id(site)
+    if endpoint_id == router["_sid"]:
+        emit(
+            f'Successfully created exchange site for router '
+            f'{endpoint_id} {router["name"]}'
+        )
+    else:
+        emit(
+            f"Site created for router {router['id']} {router['name']}; "
+            "could not verify endpoint (unexpected API response structure)."
+        )
+
+
+def report_listing(ncx_network_id: str, network_unverified: list[tuple[dict, str]], future: Future) -> None:
+    """ReportingPool callback: verify the network's (router, site_name) pairs against its fetch_network_sites call."""
+    try:
+        by_name = future.result()
+    except Exception as e:
+        emit(f"Error listing NCX sites for network {ncx_network_id}: {type(e).__name__}: {e}")
+        by_name = None
+    if by_name is None:
+        # The creates succeeded; only the check is missing, so this is not reported as a create error
+        for router, _ in network_unverified:
+            report_unverified(router, f"no site listing for network {ncx_network_id}")
+        return
+    for router, site_name in network_unverified:
+        report_verified(router, by_name.get(site_name))
+
+
+def create_ncx_sites(
+    mode: str, rows: Iterable[tuple[str, str, str | None]], verify: bool | None = None
+) -> None:
+    """
+    Create NCX sites for routers specified by mode and (identifier, ncx_network_id, site_name_override) rows.
+    verify: True always checks endpoints against the network site listing, False never fetches it, and None
+    (default) fetches it only for sites whose create response lacked the endpoint.
+    """
     api_keys = build_api_keys()
-    token = api_keys.get("token") or os.environ.get("TOKEN") or os.environ.get("NCM_API_TOKEN")
+    token = api_keys.token
     if not token:
         print("Error: TOKEN or NCM_API_TOKEN is required for NCX v3 API (set in API Keys tab).")
         return
 
-    n2 = ncm.NcmClientv2(api_keys=api_keys, log_events=False)
+    n2 = ncm.NcmClientv2(api_keys=api_keys.v2_headers(), log_events=False)
     n3 = ncm.NcmClientv3(api_key=token, log_events=False)
-
-    for identifier, ncx_network_id, site_name_override in rows:
-        if mode == "router_id":
-            routers = n2.get_routers(id__in=[identifier])
-        else:
-            routers = n2.get_routers(group=identifier, limit="all")
-
-        if not routers:
-            print(f"No routers found for {mode}={identifier!r}.")
-            continue
-
-        for router in routers:
-            site_name = site_name_override or router["name"]
-            site = n3.create_exchange_site(
-                site_name, ncx_network_id, router["id"]
-            )
-            # API may return a string (e.g. site id) or a dict (created resource) on success
-            if isinstance(site, str):
-                pass  # success, continue to verify
-            elif isinstance(site, dict) and (site.get("data") or site.get("id")):
-                # Many REST APIs return the created object; treat as success
-                pass
+    configure_session(n2)
+    configure_session(n3)
+
+    limiter = RateLimiter(V3_MAX_REQUESTS_PER_MINUTE, 60.0)
+    seen: set[tuple[str, str]] = set()
+    # Bound once here rather than looked up again for every router in the loop
+    create = functools.partial(create_site, n3.create_exchange_site, limiter)
+
+    # Sites whose create response lacked endpoints are verified with one site listing per network rather
+    # than a name lookup per router. A network is listed once every row has been read (a later row can add
+    # to any network) and its last create has finished. By then ReportingPool has at most 2 * MAX_WORKERS
+    # creates still unreported, so a listing overlaps only that tail of other networks' creates; with a
+    # single network (the usual CSV) verification starts after creation ends.
+    in_flight: Counter[str] = Counter()
+    unverified: dict[str, list[tuple[dict, str]]] = {}
+    rows_done = False
+
+    def list_if_complete(ncx_network_id: str) -> None:
+        if rows_done and not in_flight[ncx_network_id] and ncx_network_id in unverified:
+            report = functools.partial(report_listing, ncx_network_id, unverified.pop(ncx_network_id))
+            pool.submit(report, fetch_network_sites, n3, limiter, ncx_network_id)
+
+    def finish_create(router: dict, site_name: str, ncx_network_id: str, future: Future) -> None:
+        in_flight[ncx_network_id] -= 1
+        if report_create(future, router):
+            resource = None if verify else created_site_resource(future.result())
+            if resource is not None:
+                report_verified(router, resource)
+            elif verify is False:
+                emit(f'Created exchange site for router {router["id"]} {router["name"]} (not verified)')
             else:
-                # Real failure: show what the API returned (e.g. license/validation errors)
-                print(
-                    f'Error creating NCX site for router {router["id"]} {router["name"]}.  '
-                    "Check subscriptions (router may need NCX-capable subscription / network license)."
-                )
-                if site is not None:
-                    print(f"  API response: {site}")
-                continue
-
-            sites = n3.get_exchange_sites(name=site_name)
-            if not sites:
-                print(
-                    f'Error creating NCX site for router {router["id"]} {router["name"]}.'
-                )
-                continue
-
-            site_router_id = ""
-            try:
-                first = sites[0]
-                if not isinstance(first, dict):
-                    print(
-                        f'Created exchange site for router {router["id"]} {router["name"]} '
-                        "(could not verify endpoint: unexpected API response format)"
-                    )
-                else:
-                    site_router_id = first["relationships"]["endpoints"]["data"][0]["id"]
-                    if str(site_router_id) != str(router["id"]):
-                        raise ValueError
-                    print(
-                        f'Successfully created exchange site for router '
-                        f'{site_router_id} {router["name"]}'
-                    )
-            except (KeyError, IndexError, ValueError, TypeError):
-                print(
-                    f"Site created for router {router['id']} {router['name']}; "
-                    "could not verify endpoint (unexpected API response structure)."
-                )
+                unverified.setdefault(ncx_network_id, []).append((router, site_name))
+        list_if_complete(ncx_network_id)
+
+    # Routers are resolved serially; each router's create runs on the pool
+    with ReportingPool() as pool:
+        submit = pool.submit
+        try:
+            for (identifier, ncx_network_id, site_name_override), routers in iter_row_routers(n2, mode, rows):
+                if mode != "router_id":
+                    # One site per router in the group: names come from the routers, not the CSV
+                    site_name_override = None
+                if not routers:
+                    emit(f"No routers found for {mode}={identifier!r}.")
+                    continue
 
+                for router in routers:
+                    # Duplicate CSV rows (or a router reached twice) would only issue redundant create calls
+                    key = (router["_sid"], ncx_network_id)
+                    if key in seen:
+                        emit(f'Skipping duplicate router {router["id"]} {router["name"]} in network {ncx_network_id}.')
+                        continue
+                    seen.add(key)
+                    site_name = site_name_override or router["name"]
+                    report = functools.partial(finish_create, router, site_name, ncx_network_id)
+                    submit(report, create, router, site_name, ncx_network_id)
+                    # Counted once submitted: an interrupt while submit() waits must not leave it in flight
+                    in_flight[ncx_network_id] += 1
+        finally:
+            # Also on a CSV error mid-run: sites already created still get verified and reported
+            rows_done = True
+            for ncx_network_id in list(unverified):
+                list_if_complete(ncx_network_id)
 
-def main() -> None:
-    if len(sys.argv) < 2:
-        print('Usage: python "Create NCX Sites.py" <config_csv_path>')
-        sys.exit(1)
 
-    csv_filename = sys.argv[1]
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Create NCX sites for routers listed by router_id, group_id, or group_name in a CSV file"
+    )
+    parser.add_argument("csv_file", help="Path to the config CSV file")
+    parser.add_argument(
+        "--verify",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="Always (--verify) or never (--no-verify) verify site endpoints with a site listing per network "
+        "(default: only when the create response lacks the endpoint)",
+    )
+    args = parser.parse_args()
+
+    csv_filename = args.csv_file
 
     try:
-        mode, rows = load_config_from_csv(csv_filename)
+        mode, rows = load_config(csv_filename, required=("ncx_network_id",), optional=("site_name",))
     except Exception as exc:
         print(f"Error reading configuration from CSV: {exc}")
         sys.exit(1)
 
-    create_ncx_sites(mode, rows)
+    try:
+        create_ncx_sites(mode, rows, verify=args.verify)
+    except ConfigError as exc:
+        emit(f"Error reading configuration from CSV: {exc}")
+        sys.exit(1)
+    finally:
+        emit.flush()
 
 
 if __name__ == "__main__":
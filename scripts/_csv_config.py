@@ -0,0 +1,160 @@
+"""
+Config CSV loading for the NCX scripts (Create NCX Sites, Create NCX Resources, Create NCX LAN Resources).
+
+Each config CSV names its devices with a router/device column ("id", "router_id", "router id") or a group
+column ("group_id"/"group_name") plus script-specific data columns. load_config() resolves the header once
+and then streams data rows, so API work can start on the first row while the rest of the file is read.
+"""
+
+import csv
+import io
+import itertools
+import sys
+from collections.abc import Iterator
+
+# Accepted (lowercased) header spellings for each column, in priority order. Interned so header
+# lookups compare by identity.
+_ALIASES = {
+    name: tuple(sys.intern(alias) for alias in aliases)
+    for name, aliases in {
+        "router_id": ("id", "router_id", "router id"),
+        "group_id": ("group_id", "group id"),
+        "group_name": ("group_name", "group name"),
+        "ncx_network_id": ("ncx_network_id", "ncx network id"),
+        "site_name": ("site_name", "site name"),
+        "resource": ("resource", "target"),
+        "resource_name": ("resource_name", "resource name"),
+    }.items()
+}
+
+
+class ConfigError(ValueError):
+    """The config CSV is unusable: raised by load_config() for the header, or by its rows while they stream."""
+
+
+def _resolve(headers: dict[str, int], name: str) -> int | None:
+    """Column index of the first header matching one of name's aliases, or None."""
+    return next((headers[a] for a in _ALIASES[name] if a in headers), None)
+
+
+def load_config(
+    csv_filename: str,
+    required: tuple[str, ...] = ("ncx_network_id",),
+    optional: tuple[str, ...] = (),
+    hints: dict[str, str] | None = None,
+) -> tuple[str, Iterator[tuple[str | None, ...]]]:
+    """
+    Read the CSV header and determine mode (router_id, group_id, or group_name).
+    hints maps a required column to a short explanation appended to its missing-column error.
+    Returns (mode, rows) where rows yields (identifier, *required_values, *optional_values) per data row;
+    rows missing the identifier or any required value are skipped, and empty optional values are None.
+    Group modes yield only the first row.
+    Header problems (no device/group column, both group columns, a missing required column) raise ConfigError
+    from the header alone, before any data row is read. A line that cannot be decoded or parsed raises
+    ConfigError when rows reaches it.
+    """
+    try:
+        raw = open(csv_filename, "rb", buffering=1 << 20)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"CSV file not found: {csv_filename}") from None
+    # Decode straight off the 1 MiB binary buffer with a fixed codec: no locale lookup, and newline=""
+    # hands line endings to csv untranslated
+    f = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+    try:
+        reader = csv.reader(f)
+        try:
+            fieldnames = next(reader, None)
+        except UnicodeDecodeError as exc:
+            raise ConfigError(
+                f"CSV is not valid UTF-8 at byte offset {_decode_error_offset(f, exc)}: {exc.reason}"
+            ) from None
+        except csv.Error as exc:
+            raise ConfigError(f"CSV line {reader.line_num}: {exc}") from None
+        if not fieldnames:
+            raise ConfigError("CSV file has no header row")
+
+        headers = {sys.intern(h.lower().strip()): i for i, h in enumerate(fieldnames)}
+
+        router_idx = _resolve(headers, "router_id")
+        group_id_idx = _resolve(headers, "group_id")
+        group_name_idx = _resolve(headers, "group_name")
+
+        if router_idx is not None:
+            mode, ident_idx = "router_id", router_idx
+        elif group_id_idx is not None and group_name_idx is not None:
+            raise ConfigError(
+                "CSV must not contain both 'group_id' and 'group_name'; use one or the other. "
+                f"(found: {fieldnames})"
+            )
+        elif group_id_idx is not None:
+            mode, ident_idx = "group_id", group_id_idx
+        elif group_name_idx is not None:
+            mode, ident_idx = "group_name", group_name_idx
+        else:
+            raise ConfigError(
+                "CSV must contain a router/device column ('id' or 'router_id') or a group "
+                "column ('group_id' or 'group_name'). " f"(found: {fieldnames})"
+            )
+
+        required_idx = []
+        for name in required:
+            idx = _resolve(headers, name)
+            if idx is None:
+                aliases = " or ".join(repr(a) for a in _ALIASES[name])
+                hint = (hints or {}).get(name)
+                hint = f" ({hint})" if hint else ""
+                raise ConfigError(f"CSV must contain {aliases}{hint}. (found: {fieldnames})")
+            required_idx.append(idx)
+        optional_idx = [_resolve(headers, name) for name in optional]
+
+        rows = _iter_rows(f, reader, mode, [ident_idx, *required_idx], optional_idx)
+        # Peek so a file without any usable data row fails here rather than mid-run
+        first = next(rows, None)
+    except BaseException:
+        f.close()
+        raise
+
+    if first is None:
+        names = [mode, *required]
+        raise ConfigError(f"No data row with {', '.join(names[:-1])} and {names[-1]} found")
+    return mode, itertools.chain([first], rows)
+
+
+def _iter_rows(
+    f, reader, mode: str, required_idx: list[int], optional_idx: list[int | None]
+) -> Iterator[tuple[str | None, ...]]:
+    """Yield config rows from an open reader positioned after the header; closes f when done."""
+    width = max([*required_idx, *(i for i in optional_idx if i is not None)]) + 1
+    with f:
+        # Rows stream while the caller is already making API calls, so a bad line further down
+        # surfaces here mid-run; report it by position instead of as a raw decode/parse traceback
+        try:
+            for row in reader:
+                if len(row) < width:
+                    # Short (or blank) rows: missing trailing cells read as empty
+                    row += [""] * (width - len(row))
+                values = [row[i].strip() for i in required_idx]
+                if not all(values):
+                    continue
+                values.extend((row[i].strip() or None) if i is not None else None for i in optional_idx)
+                yield tuple(values)
+                if mode != "router_id":
+                    return
+        except UnicodeDecodeError as exc:
+            raise ConfigError(
+                f"CSV is not valid UTF-8 at byte offset {_decode_error_offset(f, exc)}: {exc.reason}; "
+                f"rows after line {reader.line_num} were not read"
+            ) from None
+        except csv.Error as exc:
+            raise ConfigError(
+                f"CSV line {reader.line_num}: {exc}; that line and the rows after it were not read"
+            ) from None
+
+
+def _decode_error_offset(f, exc: UnicodeDecodeError) -> int:
+    """
+    Byte offset in the file of a decode error raised by f. TextIOWrapper decodes whole chunks, so exc.start
+    is relative to the chunk just read, which ends at f.buffer.tell().
+    """
+    return f.buffer.tell() - len(exc.object) + exc.start
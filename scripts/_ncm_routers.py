@@ -0,0 +1,87 @@
+"""Router and NCX site lookups used by the NCX scripts."""
+
+import itertools
+from collections.abc import Iterable, Iterator
+
+from _csv_config import ConfigError
+from ncm import ncm
+
+# router_id rows resolved per get_routers(id__in=...) call (the NCM limit for __in filters)
+ROUTER_BATCH_SIZE = 100
+
+
+def _with_sid(routers: list[dict]) -> list[dict]:
+    """Store each router's id as a str under "_sid" once, instead of str() on every comparison."""
+    for r in routers:
+        r["_sid"] = str(r["id"])
+    return routers
+
+
+def _id_key(router_id: str) -> str | None:
+    """router_id as the API's id string (leading zeros dropped), or None when it is not a plain number."""
+    return str(int(router_id)) if router_id.isascii() and router_id.isdigit() else None
+
+
+def iter_row_routers(
+    n2: ncm.NcmClientv2, mode: str, rows: Iterable[tuple]
+) -> Iterator[tuple[tuple, list[dict]]]:
+    """
+    Pair each config row (identifier first, as yielded by load_config) with its routers. router_id rows are
+    resolved ROUTER_BATCH_SIZE at a time with one get_routers(id__in=...) call per batch; a group row is
+    listed with get_routers(group=...). Every router carries its id as a str under "_sid". A ConfigError
+    from rows is raised after the rows read before it have been yielded.
+    """
+    get_routers = n2.get_routers
+    if mode != "router_id":
+        # load_config yields a single row in group modes
+        for row in rows:
+            yield row, _with_sid(get_routers(group=row[0], limit="all"))
+        return
+
+    rows = iter(rows)
+    while True:
+        batch: list[tuple] = []
+        error = None
+        try:
+            batch.extend(itertools.islice(rows, ROUTER_BATCH_SIZE))
+        except ConfigError as exc:
+            # A bad line mid-batch: the rows read before it are still resolved and yielded, then it is raised
+            error = exc
+        if batch:
+            # A malformed id fails the whole id__in request (ncm then returns no routers for any of them),
+            # so only numeric ids are queried; the other rows find no router. Ids are normalized with
+            # str(int(...)) so "007" matches the router the API returns as 7
+            keys = [_id_key(row[0]) for row in batch]
+            ids = [i for i in dict.fromkeys(keys) if i is not None]
+            routers = get_routers(id__in=ids, limit="all") if ids else []
+            by_id = {r["_sid"]: r for r in _with_sid(routers)}
+            for row, key in zip(batch, keys):
+                router = by_id.get(key) if key is not None else None
+                yield row, [router] if router else []
+        if error is not None:
+            raise error
+        if len(batch) < ROUTER_BATCH_SIZE:
+            return
+
+
+# get_exchange_sites(name=...) results keyed by site name; many rows share a site, and misses are cached too
+_site_cache: dict[str, list] = {}
+
+
+def get_sites_by_name(n3: ncm.NcmClientv3, name: str) -> list:
+    """n3.get_exchange_sites(name=name), fetched once per name."""
+    sites = _site_cache.get(name)
+    if sites is None:
+        sites = _site_cache[name] = n3.get_exchange_sites(name=name)
+    return sites
+
+
+def site_router_id(site: dict) -> str | None:
+    """The id (as a str, like a router's "_sid") of the site's first endpoint router, or None when it has none."""
+    # Explicit lookups rather than try/except: a site for another router is the common mismatch
+    try:
+        endpoints = ((site.get("relationships") or {}).get("endpoints") or {}).get("data") or []
+        router_id = endpoints[0].get("id") if endpoints else None
+    except (AttributeError, TypeError):  # relationships not shaped like JSON:API
+        return None
+    return None if router_id is None else str(router_id)
@@ -0,0 +1,109 @@
+"""NCM API credentials and client session setup used by the NCX scripts."""
+
+import os
+from typing import NamedTuple
+
+from ncm import ncm
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; responses are then parsed by requests as usual
+    orjson = None
+
+# Read once at import; the environment does not change while a script runs
+_ENV = {
+    k: os.environ.get(k, "")
+    for k in ("X_ECM_API_ID", "X_ECM_API_KEY", "X_CP_API_ID", "X_CP_API_KEY", "TOKEN", "NCM_API_TOKEN")
+}
+
+
+class ApiKeys(NamedTuple):
+    """NCM API v2 key pair headers plus the NCX v3 token."""
+
+    ecm_api_id: str
+    ecm_api_key: str
+    cp_api_id: str
+    cp_api_key: str
+    token: str
+
+    def v2_headers(self) -> dict[str, str]:
+        """The v2 key headers in the dict form NcmClientv2 expects (the v3 token is not sent to v2)."""
+        return {
+            "X-ECM-API-ID": self.ecm_api_id,
+            "X-ECM-API-KEY": self.ecm_api_key,
+            "X-CP-API-ID": self.cp_api_id,
+            "X-CP-API-KEY": self.cp_api_key,
+        }
+
+
+def build_api_keys() -> ApiKeys:
+    """Build API keys from the environment snapshot; token falls back from TOKEN to NCM_API_TOKEN."""
+    return ApiKeys(
+        ecm_api_id=_ENV["X_ECM_API_ID"],
+        ecm_api_key=_ENV["X_ECM_API_KEY"],
+        cp_api_id=_ENV["X_CP_API_ID"],
+        cp_api_key=_ENV["X_CP_API_KEY"],
+        token=_ENV["TOKEN"] or _ENV["NCM_API_TOKEN"],
+    )
+
+
+class _CreateSafeRetry(Retry):
+    """
+    Retry that never repeats a create that may already have been applied. Only GET is in allowed_methods,
+    so GETs are retried on read errors and on status_forcelist. The NCX create calls (POST) are not
+    idempotent: a read error, 502 or 504 can follow a create the server already committed. POST is therefore
+    retried only on POST_STATUS_FORCELIST statuses, which the server returns before doing the work, and
+    never after a read error. Connection errors are retried for both, since then nothing was sent.
+    """
+
+    POST_STATUS_FORCELIST = frozenset([429, 503])
+
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method and method.upper() == "POST":
+            return status_code in self.POST_STATUS_FORCELIST
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+def configure_session(client: ncm.NcmClientv2 | ncm.NcmClientv3) -> None:
+    """
+    Mount a pooled, retrying adapter on the client's session so every call reuses keep-alive connections.
+    Mounted on both the client's base_url (overriding the ncm default adapter) and https:// (other API roots).
+    When orjson is installed, response bodies are also parsed with it (see _orjson_response).
+    """
+    # Rate-limit (429) and gateway errors are retried inside urllib3 with backoff, honoring Retry-After;
+    # creates only on 429/503 (see _CreateSafeRetry). When retries run out the last response is returned
+    # (not raised) so ncm reports the API error as usual.
+    retry = _CreateSafeRetry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=8, pool_maxsize=32)
+    client.session.mount("https://", adapter)
+    client.session.mount(client.base_url, adapter)
+    if orjson is not None:
+        client.session.hooks["response"].append(_orjson_response)
+
+
+def _orjson_response(response, *args, **kwargs):
+    """
+    Session response hook: parse the body with orjson, once. ncm calls response.json() several times per
+    paginated response; bodies orjson rejects (e.g. empty) fall back to requests' own parser and errors.
+    """
+    requests_json = response.json
+    parsed = []
+
+    def json(**kwargs):
+        if not parsed:
+            try:
+                parsed.append(orjson.loads(response.content))
+            except orjson.JSONDecodeError:
+                return requests_json(**kwargs)
+        return parsed[0]
+
+    response.json = json
@@ -0,0 +1,82 @@
+"""Thread pool for the NCX scripts' API calls, with results reported on the main thread."""
+
+import queue
+from collections.abc import Callable
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+
+from _csv_config import ConfigError
+
+# Concurrent API calls per script; stays below the pool_maxsize configure_session() gives each client
+MAX_WORKERS = 8
+
+
+class ReportingPool:
+    """
+    ThreadPoolExecutor whose results are reported on the submitting thread, so output lines never interleave.
+
+    Each submit() takes a report callback that is called with the finished future. Futures that finished
+    meanwhile are reported on every submit() (and report_done()), so results show up while the caller is
+    still resolving rows. At most max_pending (default 2 * max_workers) futures are unreported at a time;
+    submit() waits for one to finish beyond that, so the rows are read no faster than the API calls finish.
+
+    Leaving the with block reports every remaining future, also when the submitting loop raised a
+    ConfigError, and then re-raises. Any other exception (e.g. KeyboardInterrupt) first cancels the calls
+    not yet started: they are reported as failed with a CancelledError, and so is any later submit().
+    """
+
+    def __init__(self, max_workers: int = MAX_WORKERS, max_pending: int | None = None) -> None:
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._max_pending = max_pending or 2 * max_workers
+        self._cancelled = False
+        self._reports: dict[Future, Callable[[Future], None]] = {}
+        # Finished futures, put by worker threads via add_done_callback
+        self._done: queue.SimpleQueue[Future] = queue.SimpleQueue()
+
+    def __enter__(self) -> "ReportingPool":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and not issubclass(exc_type, ConfigError):
+            # Only the calls already running (at most max_workers) are still waited for
+            self._cancelled = True
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            while self._reports:
+                self._report(self._done.get())
+        finally:
+            # Normally nothing is left to cancel; after a second interrupt the queued calls are dropped
+            self._executor.shutdown(cancel_futures=True)
+
+    def submit(self, report: Callable[[Future], None], fn: Callable, /, *args, **kwargs) -> Future:
+        """Run fn(*args, **kwargs) on a worker; report(future) is called on this thread once it finishes."""
+        self.report_done()
+        while len(self._reports) >= self._max_pending:
+            self._report(self._done.get())
+        if self._cancelled:
+            future = Future()
+            future.cancel()
+        else:
+            future = self._executor.submit(fn, *args, **kwargs)
+        self._reports[future] = report
+        future.add_done_callback(self._done.put)
+        return future
+
+    def report_done(self) -> None:
+        """Report the futures that have already finished, without blocking."""
+        while self._reports:
+            try:
+                future = self._done.get_nowait()
+            except queue.Empty:
+                return
+            self._report(future)
+
+    def _report(self, future: Future) -> None:
+        # Callbacks may submit (and so report) further work; each future is reported once
+        report = self._reports.pop(future, None)
+        if report is None:
+            return
+        if future.cancelled():
+            # A plain CancelledError has no message; say why the call was not made
+            future = Future()
+            future.set_exception(CancelledError("not sent, the run was interrupted"))
+        report(future)